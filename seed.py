@@ -8,25 +8,37 @@ Usage:
     uv run python seed.py
 """
 
+import asyncio
 import sqlite3
 import sys
+from collections.abc import Iterator
 from datetime import datetime, timezone
 from pathlib import Path
 
 import httpx
+import orjson
 
 USGS_API = "https://earthquake.usgs.gov/fdsnws/event/1/query"
 DB_PATH = Path(__file__).parent / "data" / "earthquakes.db"
 MIN_MAGNITUDE = 4.0
 YEARS_BACK = 5
 
+# Bulk-load settings: the DB is rebuilt from scratch on every run, so a crash
+# mid-seed just means re-running — durability can be traded for speed.
+SEED_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-262144",
+)
+
 
 def create_db(conn: sqlite3.Connection) -> None:
     conn.executescript("""
         DROP TABLE IF EXISTS earthquakes;
+        DROP TABLE IF EXISTS eq_rtree;
         CREATE TABLE earthquakes (
             id TEXT PRIMARY KEY,
-            time TEXT NOT NULL,
+            time INTEGER NOT NULL,  -- epoch milliseconds (UTC)
             lat REAL NOT NULL,
             lng REAL NOT NULL,
             depth REAL NOT NULL,
@@ -38,13 +50,44 @@ def create_db(conn: sqlite3.Connection) -> None:
             sig INTEGER,
             felt INTEGER
         );
-        CREATE INDEX idx_eq_lat_lng ON earthquakes(lat, lng);
-        CREATE INDEX idx_eq_time ON earthquakes(time);
-        CREATE INDEX idx_eq_mag ON earthquakes(mag);
+        CREATE VIRTUAL TABLE eq_rtree USING rtree(
+            id_rt INTEGER PRIMARY KEY,
+            min_lat, max_lat,
+            min_lng, max_lng
+        );
     """)
 
 
-def fetch_year(client: httpx.Client, start: str, end: str) -> list[dict]:
+def create_indexes(conn: sqlite3.Connection) -> None:
+    """Build all indexes in one pass over the loaded rows."""
+    # Spatial index — keyed by earthquakes.rowid, so fill it once the
+    # INSERT OR IGNOREs have settled which rows actually exist.
+    conn.execute(
+        """INSERT INTO eq_rtree (id_rt, min_lat, max_lat, min_lng, max_lng)
+           SELECT rowid, lat, lat, lng, lng FROM earthquakes"""
+    )
+    conn.execute("CREATE INDEX idx_eq_time_mag ON earthquakes(time, mag)")
+    conn.execute("CREATE INDEX idx_eq_mag ON earthquakes(mag)")
+
+
+def year_ranges(now: datetime) -> list[tuple[str, str]]:
+    """Build (start, end) date pairs for each of the last YEARS_BACK years."""
+    ranges = []
+    for i in range(YEARS_BACK):
+        end_year = now.year - i
+        start_year = end_year - 1
+
+        if i == 0:
+            end_date = now.strftime("%Y-%m-%d")
+        else:
+            end_date = f"{end_year}-{now.month:02d}-{now.day:02d}"
+
+        start_date = f"{start_year}-{now.month:02d}-{now.day:02d}"
+        ranges.append((start_date, end_date))
+    return ranges
+
+
+async def fetch_year(client: httpx.AsyncClient, start: str, end: str) -> list[dict]:
     """Fetch one year of earthquake data from USGS."""
     params = {
         "format": "geojson",
@@ -54,87 +97,87 @@ def fetch_year(client: httpx.Client, start: str, end: str) -> list[dict]:
         "orderby": "time",
         "limit": 20000,
     }
-    resp = client.get(USGS_API, params=params, timeout=60)
+    resp = await client.get(USGS_API, params=params)
     resp.raise_for_status()
-    data = resp.json()
+    data = orjson.loads(resp.content)
     features = data.get("features", [])
     return features
 
 
-def feature_to_row(feature: dict) -> tuple:
-    """Convert a GeoJSON Feature to a database row tuple."""
-    props = feature["properties"]
-    coords = feature["geometry"]["coordinates"]  # [lng, lat, depth]
-
-    # USGS time is epoch milliseconds
-    time_ms = props.get("time")
-    time_iso = (
-        datetime.fromtimestamp(time_ms / 1000, tz=timezone.utc).isoformat()
-        if time_ms
-        else None
-    )
-
-    return (
-        feature["id"],
-        time_iso,
-        coords[1],  # lat
-        coords[0],  # lng
-        coords[2] if len(coords) > 2 else 0.0,  # depth km
-        props.get("mag", 0.0),
-        props.get("magType"),
-        props.get("place"),
-        props.get("status"),
-        props.get("tsunami", 0),
-        props.get("sig"),
-        props.get("felt"),
-    )
+async def fetch_all(ranges: list[tuple[str, str]]) -> list[list[dict]]:
+    """Fetch every year concurrently over one pooled HTTP/2 client."""
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    ) as client:
+        return await asyncio.gather(
+            *(fetch_year(client, start, end) for start, end in ranges)
+        )
+
+
+def feature_rows(features: list[dict]) -> Iterator[tuple]:
+    """Yield a database row tuple per GeoJSON Feature, straight into executemany.
+
+    One tight loop instead of a function call per feature; ~100k features
+    pass through here on a full seed.
+    """
+    for feature in features:
+        props = feature["properties"]
+        get = props.get
+        coords = feature["geometry"]["coordinates"]  # [lng, lat, depth]
+        yield (
+            feature["id"],
+            get("time"),  # USGS time is already epoch milliseconds
+            coords[1],  # lat
+            coords[0],  # lng
+            coords[2] if len(coords) > 2 else 0.0,  # depth km
+            get("mag", 0.0),
+            get("magType"),
+            get("place"),
+            get("status"),
+            get("tsunami", 0),
+            get("sig"),
+            get("felt"),
+        )
 
 
 def main() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
+    for pragma in SEED_PRAGMAS:
+        conn.execute(pragma)
     create_db(conn)
 
-    now = datetime.now(timezone.utc)
+    ranges = year_ranges(datetime.now(timezone.utc))
+    print(f"Fetching {len(ranges)} years from USGS...", flush=True)
+    results = asyncio.run(fetch_all(ranges))
     total = 0
 
-    with httpx.Client() as client:
-        for i in range(YEARS_BACK):
-            end_year = now.year - i
-            start_year = end_year - 1
-
-            # Build date boundaries
-            if i == 0:
-                end_date = now.strftime("%Y-%m-%d")
-            else:
-                end_date = f"{end_year}-{now.month:02d}-{now.day:02d}"
-
-            start_date = f"{start_year}-{now.month:02d}-{now.day:02d}"
-
-            print(f"Fetching {start_date} → {end_date}...", end=" ", flush=True)
-
-            features = fetch_year(client, start_date, end_date)
-            rows = [feature_to_row(f) for f in features]
-
+    # One transaction for the whole load; indexes are built after the inserts
+    # so they're written once instead of maintained row by row.
+    with conn:
+        for (start_date, end_date), features in zip(ranges, results):
             conn.executemany(
                 """INSERT OR IGNORE INTO earthquakes
                    (id, time, lat, lng, depth, mag, mag_type, place, status, tsunami, sig, felt)
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                rows,
+                feature_rows(features),
             )
-            conn.commit()
 
-            print(f"{len(rows)} events")
-            total += len(rows)
+            print(f"  {start_date} → {end_date}: {len(features)} events")
+            total += len(features)
+
+        create_indexes(conn)
 
     # Final stats
     cursor = conn.execute("SELECT COUNT(*) FROM earthquakes")
     db_count = cursor.fetchone()[0]
+    conn.close()  # checkpoints the WAL back into the main file
+
     print(f"\nDone. {total} fetched, {db_count} unique events in database.")
     print(f"Database: {DB_PATH} ({DB_PATH.stat().st_size / 1024 / 1024:.1f} MB)")
 
-    conn.close()
-
 
 if __name__ == "__main__":
     main()
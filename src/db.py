@@ -2,31 +2,170 @@
 Database queries for earthquake data.
 
 All queries use parameterized SQL against a local SQLite database.
-No ORM — just sqlite3 and plain dicts.
+No ORM — just sqlite3 rows and dicts (or JSON built by SQLite itself).
 """
 
 import sqlite3
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
 DB_PATH = Path(__file__).parent.parent / "data" / "earthquakes.db"
 
+# Bbox filter via the eq_rtree spatial index (see seed.py). A pair of lat/lng
+# BETWEENs can only use a B-tree for one axis; the R*Tree prunes both at once.
+# Points are stored as degenerate boxes, so min/max columns hold the same value.
+# Params: min_lat, max_lat, min_lng, max_lng.
+BBOX_CONDITION = """earthquakes.rowid IN (
+    SELECT id_rt FROM eq_rtree
+    WHERE max_lat >= ? AND min_lat <= ? AND max_lng >= ? AND min_lng <= ?
+)"""
+
+ONE_DAY_MS = 24 * 60 * 60 * 1000
+
+
+def date_to_ms(date_str: str) -> int:
+    """Convert YYYY-MM-DD to Unix milliseconds."""
+    return int(
+        datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+        * 1000
+    )
+
+
+def ms_to_date(ts_ms: int) -> str:
+    """Convert Unix milliseconds to YYYY-MM-DD."""
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+# Read-side tuning: WAL so readers never wait on a journal, a 256 MiB mmap
+# and 64 MiB page cache so the whole DB stays in memory, and query_only
+# (last, since journal_mode may need to write) to guard the app connection.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA query_only=1",
+)
+
 
 def get_connection() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-# Module-level connection (FastAPI is single-process, SQLite reads are safe)
-_conn: sqlite3.Connection | None = None
+# One connection per thread — route handlers run in Starlette's threadpool,
+# and a sqlite3 connection must not be used by two threads at once. WAL lets
+# the readers proceed in parallel.
+_local = threading.local()
 
 
 def _get_conn() -> sqlite3.Connection:
-    global _conn
-    if _conn is None:
-        _conn = get_connection()
-    return _conn
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = get_connection()
+    return conn
+
+
+# Window aggregates run over every filtered row before ORDER BY/LIMIT, so the
+# summary stats ride along on each returned row — one pass, one round-trip.
+_QUAKES_SQL = """
+    SELECT
+        id, time, lat, lng, depth, mag, mag_type, place, tsunami, sig, felt,
+        COUNT(*) OVER () as stats_count,
+        ROUND(AVG(mag) OVER (), 1) as stats_avg_mag,
+        ROUND(MAX(mag) OVER (), 1) as stats_max_mag,
+        ROUND(AVG(depth) OVER (), 0) as stats_avg_depth
+    FROM earthquakes
+    WHERE {where}
+    ORDER BY mag DESC, time DESC
+    LIMIT ?
+"""
+
+# Same filter/order as _QUAKES_SQL, but SQLite serializes the rows into a
+# JSON array of GeoJSON Features so no Python objects are built per row.
+_QUAKES_JSON_SQL = """
+    SELECT json_group_array(json_object(
+        'type', 'Feature',
+        'id', id,
+        'geometry', json_object(
+            'type', 'Point',
+            'coordinates', json_array(lng, lat, depth)
+        ),
+        'properties', json_object(
+            'mag', mag,
+            'mag_type', mag_type,
+            'place', place,
+            'time', time,
+            'depth', depth,
+            'tsunami', tsunami,
+            'sig', sig,
+            'felt', felt
+        )
+    ))
+    FROM (
+        SELECT id, time, lat, lng, depth, mag, mag_type, place, tsunami, sig, felt
+        FROM earthquakes
+        WHERE {where}
+        ORDER BY mag DESC, time DESC
+        LIMIT ?
+    )
+"""
+
+# One row per grid cell of `cell` degrees (bound twice, before the filter
+# params). Markers sit at the mean position of the quakes they summarize.
+_CLUSTERS_SQL = """
+    SELECT
+        CAST(ROUND(lat / ?) AS INTEGER) as cell_lat,
+        CAST(ROUND(lng / ?) AS INTEGER) as cell_lng,
+        AVG(lat) as lat,
+        AVG(lng) as lng,
+        COUNT(*) as count,
+        MAX(mag) as max_mag
+    FROM earthquakes
+    WHERE {where}
+    GROUP BY cell_lat, cell_lng
+"""
+
+
+@lru_cache(maxsize=16)
+def _build_sql(template: str, has_start: bool, has_end: bool) -> str:
+    """Fill a query template's WHERE clause for the given filter shape.
+
+    Only the presence of the date bounds changes the SQL text, so each
+    template has at most four variants — built once, then reused.
+    """
+    conditions = [BBOX_CONDITION, "mag >= ?"]
+    if has_start:
+        conditions.append("time >= ?")
+    if has_end:
+        conditions.append("time < ?")
+    return template.format(where=" AND ".join(conditions))
+
+
+def _filter_params(
+    min_lat: float,
+    max_lat: float,
+    min_lng: float,
+    max_lng: float,
+    start_date: str | None,
+    end_date: str | None,
+    min_mag: float,
+) -> list[Any]:
+    """Bind values matching the conditions emitted by _build_sql."""
+    params: list[Any] = [min_lat, max_lat, min_lng, max_lng, min_mag]
+    if start_date:
+        params.append(date_to_ms(start_date))
+    if end_date:
+        # Add a day to make end_date inclusive
+        params.append(date_to_ms(end_date) + ONE_DAY_MS)
+    return params
 
 
 def get_earthquakes(
@@ -38,40 +177,34 @@ def get_earthquakes(
     end_date: str | None = None,
     min_mag: float = 4.0,
     limit: int = 2000,
-) -> list[dict[str, Any]]:
-    """Query earthquakes with bbox, time range, and magnitude filters."""
-    conn = _get_conn()
-
-    conditions = [
-        "lat BETWEEN ? AND ?",
-        "lng BETWEEN ? AND ?",
-        "mag >= ?",
-    ]
-    params: list[Any] = [min_lat, max_lat, min_lng, max_lng, min_mag]
+) -> tuple[list[sqlite3.Row], dict[str, Any]]:
+    """Query earthquakes with bbox, time range, and magnitude filters.
 
-    if start_date:
-        conditions.append("time >= ?")
-        params.append(start_date)
-    if end_date:
-        # Add a day to make end_date inclusive
-        conditions.append("time < ?")
-        params.append(end_date + "T23:59:59")
+    Returns the strongest `limit` quakes plus summary stats over all matches.
+    """
+    conn = _get_conn()
 
+    sql = _build_sql(_QUAKES_SQL, bool(start_date), bool(end_date))
+    params = _filter_params(
+        min_lat, max_lat, min_lng, max_lng, start_date, end_date, min_mag
+    )
     params.append(limit)
 
-    sql = f"""
-        SELECT id, time, lat, lng, depth, mag, mag_type, place, tsunami, sig, felt
-        FROM earthquakes
-        WHERE {" AND ".join(conditions)}
-        ORDER BY mag DESC, time DESC
-        LIMIT ?
-    """
-
+    # Rows support q["mag"] (and q.mag in Jinja) — no need to copy into dicts
     rows = conn.execute(sql, params).fetchall()
-    return [dict(row) for row in rows]
+    if not rows:
+        return rows, {"count": 0, "avg_mag": 0, "max_mag": 0, "avg_depth": 0}
+    first = rows[0]
+    stats = {
+        "count": first["stats_count"],
+        "avg_mag": first["stats_avg_mag"],
+        "max_mag": first["stats_max_mag"],
+        "avg_depth": first["stats_avg_depth"],
+    }
+    return rows, stats
 
 
-def get_stats(
+def get_earthquakes_json(
     min_lat: float = -90,
     max_lat: float = 90,
     min_lng: float = -180,
@@ -79,39 +212,40 @@ def get_stats(
     start_date: str | None = None,
     end_date: str | None = None,
     min_mag: float = 4.0,
-) -> dict[str, Any]:
-    """Get summary stats for filtered earthquakes."""
+    limit: int = 2000,
+) -> str:
+    """Like get_earthquakes (without stats), as a JSON array of GeoJSON Features."""
     conn = _get_conn()
 
-    conditions = [
-        "lat BETWEEN ? AND ?",
-        "lng BETWEEN ? AND ?",
-        "mag >= ?",
-    ]
-    params: list[Any] = [min_lat, max_lat, min_lng, max_lng, min_mag]
+    sql = _build_sql(_QUAKES_JSON_SQL, bool(start_date), bool(end_date))
+    params = _filter_params(
+        min_lat, max_lat, min_lng, max_lng, start_date, end_date, min_mag
+    )
+    params.append(limit)
 
-    if start_date:
-        conditions.append("time >= ?")
-        params.append(start_date)
-    if end_date:
-        conditions.append("time < ?")
-        params.append(end_date + "T23:59:59")
-
-    sql = f"""
-        SELECT
-            COUNT(*) as count,
-            ROUND(AVG(mag), 1) as avg_mag,
-            ROUND(MAX(mag), 1) as max_mag,
-            ROUND(AVG(depth), 0) as avg_depth
-        FROM earthquakes
-        WHERE {" AND ".join(conditions)}
-    """
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def get_clusters(
+    cell: float,
+    min_lat: float = -90,
+    max_lat: float = 90,
+    min_lng: float = -180,
+    max_lng: float = 180,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    min_mag: float = 4.0,
+) -> list[sqlite3.Row]:
+    """Aggregate filtered earthquakes into a grid of `cell`-degree squares."""
+    conn = _get_conn()
 
-    row = conn.execute(sql, params).fetchone()
-    return (
-        dict(row) if row else {"count": 0, "avg_mag": 0, "max_mag": 0, "avg_depth": 0}
+    sql = _build_sql(_CLUSTERS_SQL, bool(start_date), bool(end_date))
+    params = [cell, cell] + _filter_params(
+        min_lat, max_lat, min_lng, max_lng, start_date, end_date, min_mag
     )
 
+    return conn.execute(sql, params).fetchall()
+
 
 def get_date_range() -> dict[str, str]:
     """Get the earliest and latest dates in the database."""
@@ -120,6 +254,6 @@ def get_date_range() -> dict[str, str]:
         "SELECT MIN(time) as min_date, MAX(time) as max_date FROM earthquakes"
     ).fetchone()
     return {
-        "min_date": row["min_date"][:10] if row["min_date"] else "2021-01-01",
-        "max_date": row["max_date"][:10] if row["max_date"] else "2026-02-26",
+        "min_date": ms_to_date(row["min_date"]) if row["min_date"] else "2021-01-01",
+        "max_date": ms_to_date(row["max_date"]) if row["max_date"] else "2026-02-26",
     }
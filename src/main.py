@@ -4,36 +4,58 @@ Earthquake Explorer — FastAPI app.
 Routes:
     GET /           — Full page with map + sidebar
     GET /quakes     — HTMX endpoint: returns markers + table rows (hx-swap-oob)
+    GET /quakes.geojson — Same filters as /quakes, as a GeoJSON FeatureCollection
 """
 
-from datetime import datetime, timedelta, timezone
+import hashlib
+import math
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
+from markupsafe import escape
 
-from db import get_earthquakes, get_stats, get_date_range
+from db import (
+    ONE_DAY_MS,
+    date_to_ms,
+    get_clusters,
+    get_date_range,
+    get_earthquakes,
+    get_earthquakes_json,
+)
 
 BASE_DIR = Path(__file__).parent
 
 app = FastAPI()
+# /quakes markup is large and repetitive — compresses several-fold
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
 
 
 # --- Template helpers ---
 
 
+# (stroke_color, fill_color) per magnitude band; _MAG_THRESHOLDS[i] is the
+# lower bound of _MAG_COLORS[i + 1]
+_MAG_THRESHOLDS = (5, 6, 7)
+_MAG_COLORS = (
+    ("#ca8a04", "#eab308"),  # gold — light
+    ("#ea580c", "#f97316"),  # orange — moderate
+    ("#dc2626", "#ef4444"),  # red — strong
+    ("#991b1b", "#dc2626"),  # dark red — major
+)
+
+
 def mag_color(mag: float) -> tuple[str, str]:
     """Return (stroke_color, fill_color) based on earthquake magnitude."""
-    if mag >= 7:
-        return "#991b1b", "#dc2626"  # dark red — major
-    elif mag >= 6:
-        return "#dc2626", "#ef4444"  # red — strong
-    elif mag >= 5:
-        return "#ea580c", "#f97316"  # orange — moderate
-    else:
-        return "#ca8a04", "#eab308"  # gold — light
+    return _MAG_COLORS[bisect_right(_MAG_THRESHOLDS, mag)]
 
 
 def mag_radius(mag: float) -> int:
@@ -41,43 +63,35 @@ def mag_radius(mag: float) -> int:
     return max(3, int(mag * 2))
 
 
-def format_time(iso_str: str) -> str:
-    """Format ISO time string to short display."""
+def format_time(ts_ms: int) -> str:
+    """Format Unix milliseconds to short display."""
     try:
-        dt = datetime.fromisoformat(iso_str)
+        dt = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
         return dt.strftime("%Y-%m-%d %H:%M")
-    except (ValueError, TypeError):
-        return iso_str[:16] if iso_str else ""
+    except (ValueError, TypeError, OverflowError):
+        return ""
 
 
-def format_time_relative(iso_str: str) -> str:
-    """Format ISO time string to relative display (e.g. '3 days ago')."""
-    try:
-        dt = datetime.fromisoformat(iso_str)
-        now = datetime.now(timezone.utc)
-        delta = now - dt
-        if delta.days > 365:
-            years = delta.days // 365
-            return f"{years}y ago"
-        elif delta.days > 30:
-            months = delta.days // 30
-            return f"{months}mo ago"
-        elif delta.days > 0:
-            return f"{delta.days}d ago"
-        elif delta.seconds > 3600:
-            return f"{delta.seconds // 3600}h ago"
-        else:
-            return f"{delta.seconds // 60}m ago"
-    except (ValueError, TypeError):
+def format_time_relative(ts_ms: int, now_ms: int) -> str:
+    """Format Unix milliseconds relative to now_ms (e.g. '3d ago')."""
+    if ts_ms is None:
         return ""
+    days, seconds = divmod((now_ms - ts_ms) // 1000, 86400)
+    if days > 365:
+        return f"{days // 365}y ago"
+    elif days > 30:
+        return f"{days // 30}mo ago"
+    elif days > 0:
+        return f"{days}d ago"
+    elif seconds > 3600:
+        return f"{seconds // 3600}h ago"
+    else:
+        return f"{seconds // 60}m ago"
 
 
-def date_to_ms(date_str: str) -> int:
-    """Convert YYYY-MM-DD to Unix milliseconds."""
-    return int(
-        datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
-        * 1000
-    )
+def current_ms() -> int:
+    """Current Unix milliseconds — taken once per request for relative times."""
+    return int(time.time() * 1000)
 
 
 def format_date_label(date_str: str) -> str:
@@ -102,15 +116,149 @@ def format_date_label(date_str: str) -> str:
 
 # Register template globals
 templates.env.globals["mag_color"] = mag_color
-templates.env.globals["mag_radius"] = mag_radius
 templates.env.globals["format_time"] = format_time
 templates.env.globals["format_time_relative"] = format_time_relative
 
+# Partials rendered on every /quakes request — resolve them once at import
+ROWS_TPL = templates.get_template("partials/rows.html")
+STATS_TPL = templates.get_template("partials/stats.html")
+
+
+# --- Marker rendering ---
+
+# (radius, stroke, fill) per half-magnitude bin, indexed by int(mag * 2).
+# mag_color's thresholds fall on whole magnitudes, so every bin maps exactly.
+_MARKER_STYLES = tuple((mag_radius(i / 2), *mag_color(i / 2)) for i in range(21))
+
+
+def render_markers(quakes) -> str:
+    """Render hyperleaflet marker divs for /quakes.
+
+    Hand-rolled rather than a Jinja partial: this runs for up to 2000 quakes
+    per map move, and the lookup table above replaces per-row helper calls.
+    """
+    styles = _MARKER_STYLES
+    last = len(styles) - 1
+    parts = []
+    for q in quakes:
+        mag = q["mag"]
+        radius, stroke, fill = styles[min(int(mag * 2), last)]
+        tsunami = "<br><b>Tsunami warning</b>" if q["tsunami"] else ""
+        parts.append(
+            f'<div data-id="{escape(q["id"])}"'
+            f' data-geometry="[{q["lat"]}, {q["lng"]}]"'
+            ' data-geometry-type="CircleMarker"'
+            f' data-radius="{radius}" data-color="{stroke}" data-fill-color="{fill}"'
+            ' data-fill-opacity="0.6" data-weight="1"'
+            f' data-popup="<b>M{mag:.1f}</b> {escape(q["mag_type"] or "")}'
+            f"<br>{escape(q['place'] or 'Unknown')}"
+            f'<br>Depth: {q["depth"]:.0f}km<br>{format_time(q["time"])}{tsunami}">'
+            "</div>\n"
+        )
+    return "".join(parts)
+
+
+# --- Clustering ---
+
+# Below this zoom, viewports that hold more quakes than one query returns
+# are drawn as grid clusters instead of the strongest individual quakes.
+CLUSTER_MAX_ZOOM = 6
+
+# Cells per side of the viewport's longer span. Caps a response at roughly
+# (CLUSTER_GRID + 2)**2 clusters — well under the 2000 markers it replaces —
+# and keeps cells ~32px wide on a typical map, so bubbles stay within them.
+CLUSTER_GRID = 32
+CLUSTER_MAX_RADIUS = 16
+
+# Matches data-zoom on #map in index.html
+INITIAL_ZOOM = 3
+
+
+def estimate_zoom(min_lng: float, max_lng: float) -> int:
+    """Approximate the Leaflet zoom level from a bbox's longitude span.
+
+    Assumes a ~1024px-wide map: at zoom z the world is 256 * 2**z px wide.
+    """
+    span = max(max_lng - min_lng, 1e-9)
+    return max(0, int(math.log2(4 * 360 / span)))
+
+
+def grid_step(size: float) -> float:
+    """Round a size in degrees up to the fixed 360 / 2**k ladder."""
+    return 360 / 2 ** max(0, math.floor(math.log2(360 / size)))
+
+
+def cluster_cell(
+    min_lat: float, max_lat: float, min_lng: float, max_lng: float
+) -> float:
+    """Grid cell size in degrees for a viewport bbox.
+
+    At least span / CLUSTER_GRID, rounded up to a fixed ladder so that
+    panning at one zoom keeps the same cells (and cluster ids and positions).
+    """
+    span = max(max_lat - min_lat, max_lng - min_lng, 1e-6)
+    return grid_step(span / CLUSTER_GRID)
+
+
+def render_clusters(clusters, cell: float) -> str:
+    """Render one aggregated marker per grid cell from db.get_clusters."""
+    styles = _MARKER_STYLES
+    last = len(styles) - 1
+    parts = []
+    for c in clusters:
+        count = c["count"]
+        max_mag = c["max_mag"]
+        _, stroke, fill = styles[min(int(max_mag * 2), last)]
+        radius = min(CLUSTER_MAX_RADIUS, 6 + int(2 * math.log2(count)))
+        parts.append(
+            f'<div data-id="cluster-{cell:g}-{c["cell_lat"]}-{c["cell_lng"]}"'
+            f' data-geometry="[{c["lat"]}, {c["lng"]}]"'
+            ' data-geometry-type="CircleMarker"'
+            f' data-radius="{radius}" data-color="{stroke}" data-fill-color="{fill}"'
+            ' data-fill-opacity="0.6" data-weight="1"'
+            f' data-popup="<b>{count} {"quake" if count == 1 else "quakes"}</b>'
+            f'<br>Max M{max_mag:.1f}">'
+            "</div>\n"
+        )
+    return "".join(parts)
+
+
+def render_map_markers(
+    quakes,
+    stats: dict,
+    zoom: int,
+    min_lat: float = -90,
+    max_lat: float = 90,
+    min_lng: float = -180,
+    max_lng: float = 180,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    min_mag: float = 4.0,
+) -> str:
+    """Render the map layer: individual quakes, or grid clusters when zoomed out."""
+    # Cluster only when zoomed out and the quake list was truncated by its limit
+    if stats["count"] <= len(quakes) or zoom >= CLUSTER_MAX_ZOOM:
+        return render_markers(quakes)
+    cell = cluster_cell(min_lat, max_lat, min_lng, max_lng)
+    clusters = get_clusters(
+        cell,
+        min_lat=min_lat,
+        max_lat=max_lat,
+        min_lng=min_lng,
+        max_lng=max_lng,
+        start_date=start_date,
+        end_date=end_date,
+        min_mag=min_mag,
+    )
+    return render_clusters(clusters, cell)
+
 
 # --- Default filter values ---
 
-ONE_YEAR_MS = 365 * 24 * 60 * 60 * 1000
-ONE_DAY_MS = 24 * 60 * 60 * 1000
+ONE_YEAR_MS = 365 * ONE_DAY_MS
+
+# The sidebar table only shows the strongest quakes; the map gets them all
+TABLE_LIMIT = 200
 
 
 def default_filters() -> dict:
@@ -130,25 +278,178 @@ def default_filters() -> dict:
 
 def parse_bbox(bbox_str: str) -> tuple[float, float, float, float]:
     """Parse Leaflet bbox string: 'min_lng,min_lat,max_lng,max_lat'."""
-    parts = [float(x) for x in bbox_str.split(",")]
-    min_lng, min_lat, max_lng, max_lat = parts
-    return min_lat, max_lat, min_lng, max_lng
+    min_lng, min_lat, max_lng, max_lat = bbox_str.split(",")
+    return float(min_lat), float(max_lat), float(min_lng), float(max_lng)
+
+
+# --- /quakes response cache ---
+
+# Snap each bbox axis to a step of about span / BBOX_SNAP_DIVISIONS, so the
+# query covers at most ~1.6% more than the viewport along each axis
+BBOX_SNAP_DIVISIONS = 256
+
+# Panning fires /quakes in quick bursts: let browsers/proxies reuse a response
+# for a few seconds, and advertise uvicorn's keep-alive window (5s default)
+QUAKES_HEADERS = {
+    "Cache-Control": "public, max-age=5",
+    "Keep-Alive": "timeout=5",
+}
+
+
+def snap_range(low: float, high: float) -> tuple[float, float]:
+    """Round one bbox axis outward to a step that scales with its span."""
+    step = grid_step(max(high - low, 1e-6) / BBOX_SNAP_DIVISIONS)
+    return math.floor(low / step) * step, math.ceil(high / step) * step
+
+
+# Each uvicorn worker holds its own cache, and entries range from a few
+# hundred bytes to several MB — so bound by size, not entry count.
+QUAKES_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Rough in-memory size of one cached sqlite3.Row for the sidebar table
+ROW_SIZE_ESTIMATE = 512
+
+
+class SizedLRUCache:
+    """Thread-safe LRU cache bounded by the approximate size of its values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int) -> None:
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            # Always keep the newest entry, even if it alone exceeds the bound
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+_parts_cache = SizedLRUCache(QUAKES_CACHE_MAX_BYTES)
+
+
+def quakes_parts(
+    min_lat: float,
+    max_lat: float,
+    min_lng: float,
+    max_lng: float,
+    start_date: str,
+    end_date: str,
+    min_mag: float,
+    zoom: int,
+) -> tuple[str, list, str, hashlib.blake2b]:
+    """Cached build_quakes_parts. Data only changes on re-seed (which means a
+    redeploy), so entries are never invalidated — a process restart clears them.
+    """
+    key = (min_lat, max_lat, min_lng, max_lng, start_date, end_date, min_mag, zoom)
+    parts = _parts_cache.get(key)
+    if parts is None:
+        parts = build_quakes_parts(*key)
+        markers_html, table_quakes, stats_html, _ = parts
+        size = (
+            len(markers_html) + len(stats_html) + ROW_SIZE_ESTIMATE * len(table_quakes)
+        )
+        _parts_cache.put(key, parts, size)
+    return parts
+
+
+def build_quakes_parts(
+    min_lat: float,
+    max_lat: float,
+    min_lng: float,
+    max_lng: float,
+    start_date: str,
+    end_date: str,
+    min_mag: float,
+    zoom: int,
+) -> tuple[str, list, str, hashlib.blake2b]:
+    """Query and render the time-independent parts of a /quakes response.
+
+    Returns (markers_html, table_quakes, stats_html, markers_hash), where
+    markers_hash has already consumed markers_html.
+    """
+    quakes, stats = get_earthquakes(
+        min_lat=min_lat,
+        max_lat=max_lat,
+        min_lng=min_lng,
+        max_lng=max_lng,
+        start_date=start_date,
+        end_date=end_date,
+        min_mag=min_mag,
+    )
+    markers_html = render_map_markers(
+        quakes,
+        stats,
+        zoom,
+        min_lat=min_lat,
+        max_lat=max_lat,
+        min_lng=min_lng,
+        max_lng=max_lng,
+        start_date=start_date,
+        end_date=end_date,
+        min_mag=min_mag,
+    )
+    stats_html = STATS_TPL.render(stats=stats)
+    markers_hash = hashlib.blake2b(markers_html.encode(), digest_size=16)
+    return markers_html, quakes[:TABLE_LIMIT], stats_html, markers_hash
+
+
+def render_quakes(parts: tuple, now_ms: int) -> tuple[str, str]:
+    """Build the /quakes HTML body and its ETag from quakes_parts.
+
+    Table rows show relative times, so they're rendered per request.
+    """
+    markers_html, table_quakes, stats_html, markers_hash = parts
+    rows_html = ROWS_TPL.render(quakes=table_quakes, now_ms=now_ms)
+
+    # Primary target is #source (markers), OOB targets are #table-wrap and #stats
+    tail = (
+        '\n<div id="table-wrap" hx-swap-oob="innerHTML"><table><thead><tr>'
+        + "<th>Mag</th><th>Location</th><th>Depth</th><th>When</th>"
+        + f"</tr></thead><tbody>{rows_html}</tbody></table></div>"
+        + f'\n<div id="stats" hx-swap-oob="innerHTML">{stats_html}</div>'
+    )
+    # Continue the cached markers hash, so the ETag covers exactly the body
+    body_hash = markers_hash.copy()
+    body_hash.update(tail.encode())
+    return markers_html + tail, f'"{body_hash.hexdigest()}"'
 
 
 # --- Routes ---
 
+# Handlers are plain `def`: SQLite calls block, so Starlette runs them in its
+# threadpool instead of on the event loop.
+
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
+def index(request: Request):
     filters = default_filters()
     date_range = get_date_range()
 
-    quakes = get_earthquakes(
+    quakes, stats = get_earthquakes(
         start_date=filters["start_date"],
         end_date=filters["end_date"],
         min_mag=filters["min_mag"],
     )
-    stats = get_stats(
+
+    markers_html = render_map_markers(
+        quakes,
+        stats,
+        INITIAL_ZOOM,
         start_date=filters["start_date"],
         end_date=filters["end_date"],
         min_mag=filters["min_mag"],
@@ -162,8 +463,10 @@ async def index(request: Request):
         request=request,
         name="index.html",
         context={
-            "quakes": quakes,
+            "markers_html": markers_html,
+            "table_quakes": quakes[:TABLE_LIMIT],
             "stats": stats,
+            "now_ms": current_ms(),
             "filters": filters,
             "date_range": date_range,
             "one_year_ms": ONE_YEAR_MS,
@@ -173,50 +476,62 @@ async def index(request: Request):
 
 
 @app.get("/quakes", response_class=HTMLResponse)
-async def get_quakes(
+def get_quakes(
     request: Request,
     bbox: str = "-180,-90,180,90",
-    start: str | None = None,
-    end: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
     min_mag: float = 4.0,
+    zoom: int | None = Query(None, ge=0, le=30),
 ):
     filters = default_filters()
-    start_date = start or filters["start_date"]
-    end_date = end or filters["end_date"]
+    min_lat, max_lat, min_lng, max_lng = parse_bbox(bbox)
+    if zoom is None:
+        zoom = estimate_zoom(min_lng, max_lng)
+
+    # Snap outward so nearby views share a cache entry; the step scales with
+    # the viewport, so stats and table stay within a few percent of what's shown
+    min_lat, max_lat = snap_range(min_lat, max_lat)
+    min_lng, max_lng = snap_range(min_lng, max_lng)
+    parts = quakes_parts(
+        min_lat,
+        max_lat,
+        min_lng,
+        max_lng,
+        start.isoformat() if start else filters["start_date"],
+        end.isoformat() if end else filters["end_date"],
+        min_mag,
+        # Zoom only matters below CLUSTER_MAX_ZOOM; above it bodies are identical
+        min(zoom, CLUSTER_MAX_ZOOM),
+    )
+    body, etag = render_quakes(parts, current_ms())
+    headers = {"ETag": etag, **QUAKES_HEADERS}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
 
+@app.get("/quakes.geojson")
+def get_quakes_geojson(
+    bbox: str = "-180,-90,180,90",
+    start: date | None = None,
+    end: date | None = None,
+    min_mag: float = 4.0,
+):
+    filters = default_filters()
     min_lat, max_lat, min_lng, max_lng = parse_bbox(bbox)
 
-    quakes = get_earthquakes(
-        min_lat=min_lat,
-        max_lat=max_lat,
-        min_lng=min_lng,
-        max_lng=max_lng,
-        start_date=start_date,
-        end_date=end_date,
-        min_mag=min_mag,
-    )
-    stats = get_stats(
+    # SQLite already produced the JSON text — wrap it without re-serializing
+    features = get_earthquakes_json(
         min_lat=min_lat,
         max_lat=max_lat,
         min_lng=min_lng,
         max_lng=max_lng,
-        start_date=start_date,
-        end_date=end_date,
+        start_date=start.isoformat() if start else filters["start_date"],
+        end_date=end.isoformat() if end else filters["end_date"],
         min_mag=min_mag,
     )
-
-    # Return markers (primary swap target) + table rows + stats (via hx-swap-oob)
-    markers_html = templates.get_template("partials/markers.html").render(quakes=quakes)
-    rows_html = templates.get_template("partials/rows.html").render(quakes=quakes)
-    stats_html = templates.get_template("partials/stats.html").render(stats=stats)
-
-    # Primary target is #source (markers), OOB targets are #table-wrap and #stats
-    return HTMLResponse(
-        content=(
-            markers_html
-            + f'\n<div id="table-wrap" hx-swap-oob="innerHTML"><table><thead><tr>'
-            + "<th>Mag</th><th>Location</th><th>Depth</th><th>When</th>"
-            + f"</tr></thead><tbody>{rows_html}</tbody></table></div>"
-            + f'\n<div id="stats" hx-swap-oob="innerHTML">{stats_html}</div>'
-        )
+    return Response(
+        content='{"type":"FeatureCollection","features":' + features + "}",
+        media_type="application/geo+json",
     )